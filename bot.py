@@ -6,10 +6,19 @@
 # OPENAI_MODEL, OPENAI_MODEL_FALLBACK, GPT_BEHAVIOR
 # TRADIER_LIVE_API_KEY, TRADIER_SANDBOX_API_KEY, TRADIER_SANDBOX_ACCOUNT_ID
 # EXTENDED_LIMIT_SLIPPAGE_BPS, EXTENDED_STOCK_ENABLED
+# Optional: LOG_BROKER_BODY=1 to log full Tradier response bodies
+# Optional: SHEETS_FLUSH_SECONDS (default 2), SHEETS_MAX_PENDING_ROWS (default 5000, per tab)
 # Optional: TIMEZONE (default America/New_York)
-
-import os, json, requests, asyncio, traceback, discord
-from datetime import datetime, timedelta
+# Optional: MESSAGE_CHANNEL_IDS (channels where plain messages are handled besides slash commands)
+
+import os, re, json, orjson, aiohttp, asyncio, traceback, discord, threading, signal, time, random, weakref
+from aiolimiter import AsyncLimiter
+from discord import app_commands
+from cachetools import TTLCache
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from typing import Optional, Literal
 
 # ---------- Timezone ----------
@@ -24,14 +33,18 @@ def _tz():
 
 _TZ = _tz()
 
+# (epoch, iso string) of the last call; log bursts within the same millisecond reuse the string
+_ts_cache = (0.0, "")
+
 def now_iso():
-    if _TZ:
-        return datetime.now(_TZ).isoformat()
-    try:
-        from datetime import timezone
-        return datetime.now(timezone.utc).isoformat()
-    except Exception:
-        return datetime.utcnow().isoformat()
+    global _ts_cache
+    t = time.time()
+    last_t, last_s = _ts_cache
+    if 0 <= t - last_t < 0.001:
+        return last_s
+    s = datetime.fromtimestamp(t, _TZ or timezone.utc).isoformat()
+    _ts_cache = (t, s)
+    return s
 
 def now_dt():
     if _TZ:
@@ -39,11 +52,22 @@ def now_dt():
     return datetime.utcnow()
 
 # ---------- OpenAI (GPT) ----------
+def _openai_http_client():
+    limits = httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=120)
+    try:
+        # HTTP/2 multiplexes concurrent completions over one long-lived connection
+        return httpx.AsyncClient(http2=True, timeout=30.0, limits=limits)
+    except ImportError as e:
+        print("OpenAI HTTP/2 unavailable (install httpx[http2]); using HTTP/1.1:", e)
+        return httpx.AsyncClient(timeout=30.0, limits=limits)
+
 try:
-    from openai import OpenAI
+    import httpx
+    from openai import AsyncOpenAI
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
-    _openai = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
-except Exception:
+    _openai = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=_openai_http_client()) if OPENAI_API_KEY else None
+except Exception as e:
+    print("OpenAI init failed:", e)
     _openai = None
 
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
@@ -67,31 +91,137 @@ CONVERSATIONS_TAB = os.getenv("CONVERSATIONS_TAB", "Conversations")  # optional,
 _sheets_ok = False
 _ws = {}
 
+# Rows are buffered per tab and written in one append_rows call per flush
+SHEETS_FLUSH_SECONDS = float(os.getenv("SHEETS_FLUSH_SECONDS", "2") or 2)
+# Failed batches are re-queued; beyond this many buffered rows per tab the oldest are dropped
+SHEETS_MAX_PENDING_ROWS = int(os.getenv("SHEETS_MAX_PENDING_ROWS", "5000") or 5000)
+# Sheets rejects any cell over 50,000 chars (HTTP 400); longer values are clipped before buffering
+SHEETS_MAX_CELL_CHARS = 45000
+_pending = {}          # tab -> deque of rows awaiting flush
+_pending_headers = {}  # tab -> header used if the tab has to be created
+_pending_lock = threading.RLock()
+_flush_lock = threading.RLock()
+_flush_task = None
+# Sheets HTTP never runs on the event loop; flushes happen on these threads
+_sheets_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="sheets")
+
+# Header rows for the tabs this bot writes to
+EVENTS_HEADER = ["timestamp", "kind", "direction", "actor", "channel_id", "user_id", "payload_json"]
+TRADES_HEADER = ["timestamp", "action", "symbol", "qty", "details_json"]
+CONVERSATIONS_HEADER = ["timestamp", "channel_id", "user_id", "user_text", "assistant_text"]
+_TAB_HEADERS = {EVENTS_TAB: EVENTS_HEADER, TRADES_TAB: TRADES_HEADER, CONVERSATIONS_TAB: CONVERSATIONS_HEADER}
+
+def _a1(tab: str, cells: str) -> str:
+    return "'" + tab.replace("'", "''") + "'!" + cells
+
+def _ensure_worksheets(headers: dict):
+    """
+    Resolve worksheets for every tab in `headers` that isn't cached yet using batched calls:
+    one metadata read, one batchUpdate for missing tabs, one batch get (+ update) for header rows.
+    """
+    missing = {tab: h for tab, h in headers.items() if tab not in _ws}
+    if not missing:
+        return
+    meta = _sheet.fetch_sheet_metadata()
+    props = {sh["properties"]["title"]: sh["properties"] for sh in meta.get("sheets", [])}
+    to_add = [tab for tab in missing if tab not in props]
+    if to_add:
+        res = _sheet.batch_update({"requests": [
+            {"addSheet": {"properties": {"title": tab, "gridProperties": {"rowCount": 2000, "columnCount": max(10, len(missing[tab]))}}}}
+            for tab in to_add
+        ]})
+        for reply in res.get("replies", []):
+            p = reply["addSheet"]["properties"]
+            props[p["title"]] = p
+    tabs = list(missing)
+    got = _sheet.values_batch_get([_a1(tab, "1:1") for tab in tabs])
+    updates = [
+        {"range": _a1(tab, "A1"), "values": [missing[tab]]}
+        for tab, vr in zip(tabs, got.get("valueRanges", []))
+        if not vr.get("values")
+    ]
+    if updates:
+        _sheet.values_batch_update({"valueInputOption": "RAW", "data": updates})
+    for tab in tabs:
+        _ws[tab] = gspread.Worksheet(_sheet, props[tab])
+
+def _bootstrap_tabs():
+    if not _sheets_ok:
+        return
+    with _flush_lock:
+        try:
+            _ensure_worksheets(_TAB_HEADERS)
+        except Exception as e:
+            print("Sheets bootstrap error:", e)
+
 def _sheet_append_row(tab: str, header: list[str], row: list):
-    global _sheets_ok, _ws
     if not _sheets_ok:
         return False
-    try:
-        ws = _ws.get(tab)
-        if not ws:
-            try:
-                ws = _sheet.worksheet(tab)
-            except Exception:
-                ws = _sheet.add_worksheet(tab, rows=2000, cols=max(10, len(header)))
-                ws.append_row(header)
-            # ensure header exists
+    with _pending_lock:
+        q = _pending.get(tab)
+        if q is None:
+            q = _pending[tab] = deque()
+            _pending_headers[tab] = header
+        q.append(row)
+    return True
+
+def _requeue_rows(tab: str, rows: list):
+    """Put a failed batch back at the front of its tab so the next flush retries it in order."""
+    with _pending_lock:
+        q = _pending[tab]
+        q.extendleft(reversed(rows))
+        dropped = 0
+        while len(q) > SHEETS_MAX_PENDING_ROWS:
+            q.popleft()
+            dropped += 1
+    if dropped:
+        print(f"Sheets buffer full ({tab}): dropped {dropped} oldest rows")
+
+def _is_transient_sheets_error(e: Exception) -> bool:
+    """429/5xx from the API or a network failure (requests errors are OSErrors) can succeed on retry."""
+    if isinstance(e, gspread.exceptions.APIError):
+        status = getattr(e.response, "status_code", 0)
+        return status == 429 or status >= 500
+    return isinstance(e, OSError)
+
+def _flush_pending():
+    """Drain every buffered tab and write each batch with a single append_rows request."""
+    if not _sheets_ok:
+        return
+    with _flush_lock:
+        with _pending_lock:
+            batches = {tab: list(q) for tab, q in _pending.items() if q}
+            for tab in batches:
+                _pending[tab].clear()
+        if not batches:
+            return
+        try:
+            _ensure_worksheets({tab: _pending_headers[tab] for tab in batches})
+        except Exception as e:
+            print("Sheets tab setup error (rows kept for retry):", e)
+        for tab, rows in batches.items():
+            ws = _ws.get(tab)
+            if ws is None:
+                # tab setup failed; keep the rows buffered for the next flush
+                _requeue_rows(tab, rows)
+                continue
             try:
-                first = ws.row_values(1)
-                if not first:
-                    ws.append_row(header)
-            except Exception:
-                pass
-            _ws[tab] = ws
-        ws.append_row(row)
-        return True
-    except Exception as e:
-        print(f"Sheets append error ({tab}):", e)
-        return False
+                ws.append_rows(rows, value_input_option="RAW", insert_data_option="INSERT_ROWS")
+            except Exception as e:
+                if not _is_transient_sheets_error(e):
+                    # permanent (e.g. 400 bad cell): retrying would stall the tab behind this batch
+                    print(f"Sheets append error ({tab}, dropped {len(rows)} rows):", e)
+                    continue
+                # NOTE: after a timeout the write may have landed anyway, so a retry can duplicate rows
+                print(f"Sheets append error ({tab}, {len(rows)} rows, will retry):", e)
+                _requeue_rows(tab, rows)
+
+async def _flush_loop():
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_sheets_executor, _bootstrap_tabs)
+    while True:
+        await asyncio.sleep(SHEETS_FLUSH_SECONDS)
+        await loop.run_in_executor(_sheets_executor, _flush_pending)
 
 try:
     import gspread
@@ -108,42 +238,48 @@ except Exception as e:
     print("Sheets init failed:", e)
     _sheets_ok = False
 
+def _dumps(obj) -> str:
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+def _clip(text: str) -> str:
+    if len(text) <= SHEETS_MAX_CELL_CHARS:
+        return text
+    return text[:SHEETS_MAX_CELL_CHARS] + "…[truncated]"
+
 def log_event(kind: str, direction: str, actor: str,
               channel_id: Optional[str], user_id: Optional[str], payload):
     ts = now_iso()
     try:
-        data = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+        data = payload if isinstance(payload, str) else _dumps(payload)
     except Exception:
         data = str(payload)
     _sheet_append_row(
-        EVENTS_TAB,
-        ["timestamp", "kind", "direction", "actor", "channel_id", "user_id", "payload_json"],
-        [ts, kind, direction, actor, str(channel_id or ""), str(user_id or ""), data]
+        EVENTS_TAB, EVENTS_HEADER,
+        [ts, kind, direction, actor, str(channel_id or ""), str(user_id or ""), _clip(data)]
     )
 
 def log_trade(action: str, symbol: str, qty: int, details):
     ts = now_iso()
     try:
-        dj = details if isinstance(details, str) else json.dumps(details, ensure_ascii=False)
+        dj = details if isinstance(details, str) else _dumps(details)
     except Exception:
         dj = str(details)
     _sheet_append_row(
-        TRADES_TAB,
-        ["timestamp", "action", "symbol", "qty", "details_json"],
-        [ts, action, symbol, int(qty), dj]
+        TRADES_TAB, TRADES_HEADER,
+        [ts, action, symbol, int(qty), _clip(dj)]
     )
 
 def log_conversation(user_text: str, assistant_text: str, channel_id: str, user_id: str):
     ts = now_iso()
     _sheet_append_row(
-        CONVERSATIONS_TAB,
-        ["timestamp", "channel_id", "user_id", "user_text", "assistant_text"],
-        [ts, channel_id, user_id, user_text or "", assistant_text or ""]
+        CONVERSATIONS_TAB, CONVERSATIONS_HEADER,
+        [ts, channel_id, user_id, _clip(user_text or ""), _clip(assistant_text or "")]
     )
 
 # ---------- Policy toggles ----------
 REQUIRE_CONFIRM_MARKET_ONLY = os.getenv("REQUIRE_CONFIRM_MARKET_ONLY", "true").strip().lower() in ("1","true","t","yes","y","on")
 EXTENDED_LIMIT_SLIPPAGE_BPS = float(os.getenv("EXTENDED_LIMIT_SLIPPAGE_BPS", "0") or 0)
+_LIMIT_SLIPPAGE_MULT = 1 + EXTENDED_LIMIT_SLIPPAGE_BPS/10000.0
 EXTENDED_STOCK_ENABLED = os.getenv("EXTENDED_STOCK_ENABLED", "false").strip().lower() in ("1","true","t","yes","y","on")
 
 def needs_confirmation(order_type: str, is_conditional: bool) -> bool:
@@ -159,57 +295,170 @@ TRADE_BASE = os.getenv("TRADIER_SANDBOX_BASE_URL", "https://sandbox.tradier.com/
 DATA_TOKEN = os.getenv("TRADIER_LIVE_API_KEY", "").strip()
 TRADE_TOKEN = os.getenv("TRADIER_SANDBOX_API_KEY", "").strip()
 TRADE_ACCT  = os.getenv("TRADIER_SANDBOX_ACCOUNT_ID", "").strip()
+# Successful responses are logged as a summary (endpoint/status/size); set to 1 to also log the full body
+LOG_BROKER_BODY = os.getenv("LOG_BROKER_BODY", "0").strip() == "1"
+# Kept well under the Sheets cell limit since the body is re-escaped when the summary is serialized
+LOG_BROKER_BODY_MAX_CHARS = 30000
 
-def tradier_data_request(endpoint: str, method: str = "GET", params=None, data=None):
-    url = f"{DATA_BASE}{endpoint if endpoint.startswith('/') else '/'+endpoint}"
-    headers = {"Authorization": f"Bearer {DATA_TOKEN}", "Accept": "application/json"}
+# Chains compress well; only advertise br when aiohttp can actually decode it
+try:
+    import brotli  # noqa: F401
+    _ACCEPT_ENCODING = "br, gzip"
+except ImportError:
+    _ACCEPT_ENCODING = "gzip"
+
+_DATA_HEADERS = {"Authorization": f"Bearer {DATA_TOKEN}", "Accept": "application/json", "Accept-Encoding": _ACCEPT_ENCODING}
+_TRADE_HEADERS = {
+    "Authorization": f"Bearer {TRADE_TOKEN}",
+    "Accept": "application/json",
+    "Accept-Encoding": _ACCEPT_ENCODING,
+    "Content-Type": "application/x-www-form-urlencoded",
+}
+TRADIER_MAX_INFLIGHT = 16  # per host
+
+# One shared aiohttp session; created lazily because it needs a running loop
+_http: Optional[aiohttp.ClientSession] = None
+_host_sems = {}
+
+def _http_session() -> aiohttp.ClientSession:
+    global _http
+    if _http is None or _http.closed:
+        _http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100, limit_per_host=TRADIER_MAX_INFLIGHT, keepalive_timeout=75),
+            timeout=aiohttp.ClientTimeout(total=20),
+        )
+    return _http
+
+def _host_sem(base: str) -> asyncio.Semaphore:
+    sem = _host_sems.get(base)
+    if sem is None:
+        sem = _host_sems[base] = asyncio.Semaphore(TRADIER_MAX_INFLIGHT)
+    return sem
+
+async def _close_http():
+    if _http is not None and not _http.closed:
+        await _http.close()
+
+# Client-side throttle per Tradier client, tightened further by the X-Ratelimit-* response headers
+_data_limiter = AsyncLimiter(max_rate=120, time_period=60)
+_trade_limiter = AsyncLimiter(max_rate=60, time_period=60)
+TRADIER_MAX_RETRIES = 4
+TRADIER_RATELIMIT_FLOOR = 5  # pause until the window resets once fewer calls than this remain
+_resume_at = {}  # base -> epoch seconds when Tradier's current rate-limit window expires
+
+def _note_ratelimit(base: str, headers):
+    try:
+        available = int(headers.get("X-Ratelimit-Available", ""))
+        expiry = int(headers.get("X-Ratelimit-Expiry", "")) / 1000.0
+    except ValueError:
+        return
+    if available < TRADIER_RATELIMIT_FLOOR:
+        _resume_at[base] = expiry
+
+def _is_retryable(status: int, method: str) -> bool:
+    # 429 means the request was rejected unprocessed; 5xx is only retried for reads so orders never double-submit
+    return status == 429 or (method.upper() == "GET" and status in (500, 502, 503, 504))
+
+# Prebuilt URLs for the endpoints the bot calls; helpers pass these keys, raw paths still work
+_DATA_URLS = {
+    "quotes": f"{DATA_BASE}/markets/quotes",
+    "chains": f"{DATA_BASE}/markets/options/chains",
+    "history": f"{DATA_BASE}/markets/history",
+}
+_TRADE_URLS = {
+    "orders": f"{TRADE_BASE}/accounts/{TRADE_ACCT}/orders",
+    "positions": f"{TRADE_BASE}/accounts/{TRADE_ACCT}/positions",
+}
+
+async def _tradier_send(label: str, base: str, urls: dict, headers: dict, limiter: AsyncLimiter,
+                        endpoint: str, method: str, params, data):
+    url = urls.get(endpoint) or f"{base}{endpoint if endpoint.startswith('/') else '/'+endpoint}"
+    for attempt in range(TRADIER_MAX_RETRIES + 1):
+        async with limiter, _host_sem(base):
+            # checked after acquiring: a response that arrived while we queued may have set a pause
+            wait = _resume_at.get(base, 0) - time.time()
+            if wait > 0:
+                await asyncio.sleep(min(wait, 60))
+            async with _http_session().request(method, url, headers=headers, params=params, data=data) as r:
+                _note_ratelimit(base, r.headers)
+                if r.ok:
+                    raw = await r.read()
+                    js = orjson.loads(raw) if raw.strip() else None
+                    summary = {"client":label,"endpoint":endpoint,"status":r.status,"len":len(raw)}
+                    if LOG_BROKER_BODY:
+                        body = _dumps(js)
+                        if len(body) > LOG_BROKER_BODY_MAX_CHARS:
+                            body = body[:LOG_BROKER_BODY_MAX_CHARS]
+                            summary["body_truncated"] = True
+                        summary["body"] = body
+                    log_event("broker","in","tradier", None, None, summary)
+                    return js
+                status, body = r.status, await r.text()
+        if attempt == TRADIER_MAX_RETRIES or not _is_retryable(status, method):
+            log_event("broker","in","tradier", None, None, {"status":status,"body":body})
+            raise RuntimeError(f"Tradier {label} {status}: {body}")
+        await asyncio.sleep(min(30, 0.5 * 2**attempt) + random.random() * 0.25)
+
+async def tradier_data_request(endpoint: str, method: str = "GET", params=None, data=None):
     log_event("broker","out","bot", None, None, {"client":"DATA","endpoint":endpoint,"method":method,"params":params})
-    r = requests.request(method, url, headers=headers, params=params, data=data, timeout=20)
-    if not r.ok:
-        log_event("broker","in","tradier", None, None, {"status":r.status_code,"body":r.text})
-        raise RuntimeError(f"Tradier DATA {r.status_code}: {r.text}")
-    js = r.json()
-    log_event("broker","in","tradier", None, None, js)
-    return js
-
-def tradier_trade_request(endpoint: str, method: str = "GET", params=None, data=None):
-    url = f"{TRADE_BASE}{endpoint if endpoint.startswith('/') else '/'+endpoint}"
-    headers = {
-        "Authorization": f"Bearer {TRADE_TOKEN}",
-        "Accept": "application/json",
-        "Content-Type": "application/x-www-form-urlencoded",
-    }
+    return await _tradier_send("DATA", DATA_BASE, _DATA_URLS, _DATA_HEADERS, _data_limiter, endpoint, method, params, data)
+
+async def tradier_trade_request(endpoint: str, method: str = "GET", params=None, data=None):
     log_event("broker","out","bot", None, None, {"client":"TRADE","endpoint":endpoint,"method":method,"params":params,"data":data})
-    r = requests.request(method, url, headers=headers, params=params, data=data, timeout=20)
-    if not r.ok:
-        log_event("broker","in","tradier", None, None, {"status":r.status_code,"body":r.text})
-        raise RuntimeError(f"Tradier TRADE {r.status_code}: {r.text}")
-    js = r.json()
-    log_event("broker","in","tradier", None, None, js)
-    return js
+    return await _tradier_send("TRADE", TRADE_BASE, _TRADE_URLS, _TRADE_HEADERS, _trade_limiter, endpoint, method, params, data)
 
 # ---------- Market data (LIVE) ----------
-def get_equity_quote(symbol: str) -> dict:
-    return tradier_data_request("/markets/quotes", params={"symbols": symbol})
-
-def get_option_chain(symbol: str, expiry: str) -> dict:
-    return tradier_data_request("/markets/options/chains", params={"symbol": symbol, "expiration": expiry, "greeks": "true"})
-
-def get_history(symbol: str, interval="hour", start: Optional[str]=None, end: Optional[str]=None) -> dict:
+# Short-lived caches collapse bursts of identical lookups; the per-key lock makes concurrent misses share one fetch
+_quote_cache = TTLCache(maxsize=1024, ttl=2)
+_chain_cache = TTLCache(maxsize=256, ttl=10)
+_cache_locks = weakref.WeakValueDictionary()  # key -> Lock, dropped once no fetch holds or awaits it
+_MISSING = object()
+
+async def _cached(cache: TTLCache, key, fetch):
+    # single get() per check: a separate `in` + [] can see the entry expire in between
+    val = cache.get(key, _MISSING)
+    if val is not _MISSING:
+        return val
+    lock = _cache_locks.get(key)
+    if lock is None:
+        lock = _cache_locks[key] = asyncio.Lock()
+    async with lock:
+        val = cache.get(key, _MISSING)
+        if val is not _MISSING:
+            return val
+        val = await fetch()
+        cache[key] = val
+        return val
+
+async def get_equity_quote(symbol: str) -> dict:
+    return await _cached(_quote_cache, ("quote", symbol),
+                         lambda: tradier_data_request("quotes", params={"symbols": symbol}))
+
+async def get_option_chain(symbol: str, expiry: str) -> dict:
+    return await _cached(_chain_cache, ("chain", symbol, expiry),
+                         lambda: tradier_data_request("chains", params={"symbol": symbol, "expiration": expiry, "greeks": "true"}))
+
+async def get_history(symbol: str, interval="hour", start: Optional[str]=None, end: Optional[str]=None) -> dict:
     params = {"symbol": symbol, "interval": interval}
     if start: params["start"] = start
     if end: params["end"] = end
-    return tradier_data_request("/markets/history", params=params)
+    return await tradier_data_request("history", params=params)
 
 # ---------- Trading (SANDBOX) ----------
+_LIMIT_TYPES = frozenset({"limit", "stop_limit"})
+_STOP_TYPES = frozenset({"stop", "stop_limit"})
+
+# Everything before the first digit is the underlying root
+_OCC_ROOT_RE = re.compile(r"^(\D*)\d")
+
 def _infer_underlying_from_occ(occ: str) -> str:
     """Best-effort extraction of underlying from OCC symbol, e.g., AMD250822C00185000 -> AMD"""
-    for i, ch in enumerate(occ):
-        if ch.isdigit():
-            return occ[:i].upper()
+    m = _OCC_ROOT_RE.match(occ)
+    if m:
+        return m.group(1).upper()
     return occ[:4].upper()
 
-def place_option_order_by_occ(occ: str, side: str, qty: int, type: str = "market",
+async def place_option_order_by_occ(occ: str, side: str, qty: int, type: str = "market",
                               limit: Optional[float] = None, stop: Optional[float] = None,
                               duration: str = "day", underlying: Optional[str] = None,
                               is_conditional: bool = False) -> dict:
@@ -217,7 +466,8 @@ def place_option_order_by_occ(occ: str, side: str, qty: int, type: str = "market
     Sends BOTH 'symbol' (underlying) and 'option_symbol' (OCC) for class=option.
     Respects confirmation policy: market only; conditional orders skip confirmation.
     """
-    if needs_confirmation(type, is_conditional):
+    t = type.lower()
+    if needs_confirmation(t, is_conditional):
         log_event("policy","out","bot", None, None, {"confirm_required": True, "reason": "market order", "occ": occ})
     underlying = (underlying or _infer_underlying_from_occ(occ))
     payload = {
@@ -226,51 +476,52 @@ def place_option_order_by_occ(occ: str, side: str, qty: int, type: str = "market
         "option_symbol": occ,        # full OCC
         "side": side,                # e.g., buy_to_open, sell_to_close
         "quantity": int(qty),
-        "type": type.lower(),
+        "type": t,
         "duration": duration,
     }
-    if limit is not None and payload["type"] in ("limit","stop_limit"):
+    if limit is not None and t in _LIMIT_TYPES:
         if EXTENDED_LIMIT_SLIPPAGE_BPS:
-            limit = float(limit) * (1 + EXTENDED_LIMIT_SLIPPAGE_BPS/10000.0)
+            limit = float(limit) * _LIMIT_SLIPPAGE_MULT
         payload["price"] = float(limit)
-    if stop is not None and payload["type"] in ("stop","stop_limit"):
+    if stop is not None and t in _STOP_TYPES:
         payload["stop"] = float(stop)
-    res = tradier_trade_request(f"/accounts/{TRADE_ACCT}/orders", method="POST", data=payload)
+    res = await tradier_trade_request("orders", method="POST", data=payload)
     log_trade(side, occ, qty, res)
     return res
 
-def place_equity_order(symbol: str, side: Literal["buy","sell"], quantity: int,
+async def place_equity_order(symbol: str, side: Literal["buy","sell"], quantity: int,
                        type: str = "market", limit: Optional[float] = None,
                        session: str = "REG", duration: str = "day",
                        is_conditional: bool = False) -> dict:
-    if needs_confirmation(type, is_conditional):
+    t = type.lower()
+    if needs_confirmation(t, is_conditional):
         log_event("policy","out","bot", None, None, {"confirm_required": True, "reason": "market order", "symbol": symbol})
     payload = {
         "class": "equity",
         "symbol": symbol.upper(),
         "side": side,
         "quantity": int(quantity),
-        "type": type.lower(),
+        "type": t,
         "duration": duration,
         "session": "EXT" if EXTENDED_STOCK_ENABLED else session.upper(),
     }
-    if limit is not None and type.lower() in ("limit","stop_limit"):
+    if limit is not None and t in _LIMIT_TYPES:
         if EXTENDED_LIMIT_SLIPPAGE_BPS:
-            limit = float(limit) * (1 + EXTENDED_LIMIT_SLIPPAGE_BPS/10000.0)
+            limit = float(limit) * _LIMIT_SLIPPAGE_MULT
         payload["price"] = float(limit)
-    res = tradier_trade_request(f"/accounts/{TRADE_ACCT}/orders", method="POST", data=payload)
+    res = await tradier_trade_request("orders", method="POST", data=payload)
     log_trade(side, symbol, quantity, res)
     return res
 
-def get_positions() -> dict:
-    return tradier_trade_request(f"/accounts/{TRADE_ACCT}/positions")
+async def get_positions() -> dict:
+    return await tradier_trade_request("positions")
 
 # ---------- OCC helper ----------
+@lru_cache(maxsize=8192)  # pure function of its arguments, so repeats are a dict hit
 def build_occ(underlying: str, expiry_yyyymmdd: str, cp: Literal["call","put"], strike: float) -> str:
-    yy = expiry_yyyymmdd[2:4]; mm = expiry_yyyymmdd[4:6]; dd = expiry_yyyymmdd[6:8]
-    cp_code = "C" if cp.lower().startswith("c") else "P"
+    cp_code = "C" if cp[:1] in ("c", "C") else "P"
     strike_int = int(round(float(strike) * 1000))
-    return f"{underlying.upper()}{yy}{mm}{dd}{cp_code}{strike_int:08d}"
+    return f"{underlying.upper()}{expiry_yyyymmdd[2:8]}{cp_code}{strike_int:08d}"
 
 # ---------- GPT Orchestrator ----------
 async def gpt_orchestrate(user_text: str, channel_id: str, user_id: str) -> str:
@@ -279,14 +530,14 @@ async def gpt_orchestrate(user_text: str, channel_id: str, user_id: str) -> str:
     try:
         log_event("gpt","out","bot", channel_id, user_id, {"prompt": user_text})
         try:
-            resp = _openai.chat.completions.create(
+            resp = await _openai.chat.completions.create(
                 model=OPENAI_MODEL,
                 messages=[{"role":"system","content": GPT_BEHAVIOR},
                           {"role":"user","content": user_text}]
             )
         except Exception:
             # fallback model
-            resp = _openai.chat.completions.create(
+            resp = await _openai.chat.completions.create(
                 model=OPENAI_MODEL_FALLBACK,
                 messages=[{"role":"system","content": GPT_BEHAVIOR},
                           {"role":"user","content": user_text}]
@@ -302,6 +553,7 @@ PENDING_CONFIRM = {}  # key: channel_id -> {user_id, original_text, expires_at}
 
 CONFIRM_WORDS = {"confirm", "yes", "y", "proceed", "go", "send", "do it"}
 CANCEL_WORDS  = {"cancel", "no", "n", "stop", "abort"}
+_MAX_CONFIRM_LEN = max(len(w) for w in CONFIRM_WORDS | CANCEL_WORDS)
 
 def _set_pending(channel_id: str, user_id: str, original_text: str, ttl_seconds: int = 120):
     PENDING_CONFIRM[channel_id] = {
@@ -328,25 +580,171 @@ def _clear_pending(channel_id: str, reason: str = "cleared"):
 
 # ---------- Discord ----------
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN", "").strip()
+# Slash commands are the primary interface. Plain messages are only read in these opt-in channels
+# (comma-separated IDs); leaving it empty also drops the privileged message_content intent.
+MESSAGE_CHANNEL_IDS = {c.strip() for c in os.getenv("MESSAGE_CHANNEL_IDS", "").split(",") if c.strip()}
 intents = discord.Intents.default()
-intents.message_content = True
+intents.message_content = bool(MESSAGE_CHANNEL_IDS)
+intents.messages = bool(MESSAGE_CHANNEL_IDS)  # off: the gateway only delivers interactions, not chatter
 client = discord.Client(intents=intents)
+tree = app_commands.CommandTree(client)
+_tree_synced = False
 
 @client.event
 async def on_ready():
+    global _flush_task, _tree_synced
     print(f"✅ Logged in as {client.user}")
+    _http_session()
     log_event("system","info","bot", None, None, "Bot started and logged in")
+    if _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.create_task(_flush_loop())
+    # SIGTERM: close the client so main() can flush buffered rows before exit
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(client.close()))
+    except (NotImplementedError, RuntimeError):
+        pass
+    if not _tree_synced:
+        try:
+            await tree.sync()
+            _tree_synced = True
+        except Exception as e:
+            print("Slash command sync failed:", e)
+            log_event("system","error","bot", None, None, f"tree.sync failed: {e}")
+
+# Handlers take a `send` coroutine so plain messages and slash-command followups share them
+async def _handle_quote(send, sym: str, content: str, ch_id: str, u_id: str):
+    try:
+        q = await get_equity_quote(sym)
+        text = f"📈 {sym} quote:\n```json\n{orjson.dumps(q, option=orjson.OPT_INDENT_2).decode()}```"
+        log_conversation(content, text, ch_id, u_id)
+        log_event("discord","out","assistant", ch_id, u_id, {"quote_symbol": sym})
+        await send(text)
+    except Exception as e:
+        err = f"❌ Quote error: {e}"
+        log_event("system","error","bot", ch_id, u_id, err)
+        await send(err)
+
+async def _handle_ask(send, content: str, ch_id: str, u_id: str):
+    reply = await gpt_orchestrate(content, ch_id, u_id)
+    # log before sending: both calls only buffer rows, so the reply isn't delayed
+    try:
+        log_conversation(content, reply, ch_id, u_id)
+        log_event("discord","out","assistant", ch_id, u_id, reply)
+    except Exception:
+        pass
+    await send(reply)
 
+    # If GPT asked for confirmation, queue it (NEW)
+    # naive heuristic: look for the word "confirm" in GPT reply
+    if "confirm" in reply.lower():
+        _set_pending(ch_id, u_id, content)
+
+async def _handle_pending(send, cancel: bool, ch_id: str, u_id: str):
+    pending = _get_pending(ch_id)
+    if not pending:
+        await send("I don't have anything pending confirmation.")
+        return
+    if pending["user_id"] != u_id:
+        await send("Only the original requester can confirm or cancel this.")
+        return
+
+    if cancel:
+        _clear_pending(ch_id, reason="canceled")
+        await send("Okay, canceled.")
+        return
+
+    # Confirm path: resubmit original instruction to GPT prefixed with CONFIRM:
+    original = pending["original_text"]
+    _clear_pending(ch_id, reason="confirmed")
+    reply = await gpt_orchestrate(f"CONFIRM: {original}", ch_id, u_id)
+    # log before sending: both calls only buffer rows, so the reply isn't delayed
+    try:
+        log_conversation(f"CONFIRM: {original}", reply, ch_id, u_id)
+        log_event("discord","out","assistant", ch_id, u_id, reply)
+    except Exception:
+        pass
+    await send(reply)
+
+# "<command> <SYMBOL>" messages handled without GPT; group(1) keys into _COMMANDS
+_SYMBOL_PATTERN = r"[A-Za-z.\-]{1,10}"
+_SYMBOL_RE = re.compile(rf"^{_SYMBOL_PATTERN}$")
+_COMMAND_RE = re.compile(rf"^(quote)\s+({_SYMBOL_PATTERN})\s*$", re.I)
+_COMMANDS = {"quote": _handle_quote}
+# Fast reject: lowercase just the head of the message before running the regex
+_COMMAND_HEAD_LEN = max(map(len, _COMMANDS))
+_COMMAND_NAMES = tuple(_COMMANDS)
+
+# Cap concurrent handlers so a burst can't fan out unbounded GPT/Tradier work; per-user cap keeps it fair
+MAX_CONCURRENT_MESSAGES = 20
+MAX_CONCURRENT_PER_USER = 2
+_msg_sem = None
+_user_sems = weakref.WeakValueDictionary()  # user_id -> Semaphore, dropped once no handler holds it
+
+def _message_sems(user_id: int):
+    global _msg_sem
+    if _msg_sem is None:
+        _msg_sem = asyncio.Semaphore(MAX_CONCURRENT_MESSAGES)
+    user_sem = _user_sems.get(user_id)
+    if user_sem is None:
+        user_sem = _user_sems[user_id] = asyncio.Semaphore(MAX_CONCURRENT_PER_USER)
+    return _msg_sem, user_sem
+
+# ---------- Slash commands ----------
+async def _run_interaction(interaction: discord.Interaction, content: str, handler, *args):
+    # GPT/Tradier can exceed Discord's 3s ack window, so defer and answer via followups
+    await interaction.response.defer(thinking=True)
+    ch_id = str(interaction.channel_id)
+    u_id  = str(interaction.user.id)
+    try:
+        log_event("discord","in","user", ch_id, u_id, content)
+    except Exception:
+        pass
+    msg_sem, user_sem = _message_sems(interaction.user.id)
+    async with user_sem, msg_sem:
+        await handler(interaction.followup.send, *args, ch_id, u_id)
+
+@tree.command(name="quote", description="Live equity quote")
+@app_commands.describe(symbol="Ticker, e.g. AAPL")
+async def quote_command(interaction: discord.Interaction, symbol: str):
+    sym = symbol.strip()
+    if not _SYMBOL_RE.match(sym):
+        # same symbol rule as the plain-message path; never reaches Tradier or the quote cache
+        await interaction.response.send_message(f"❌ Quote error: invalid symbol {sym!r}", ephemeral=True)
+        return
+    content = f"/quote {symbol}"
+    await _run_interaction(interaction, content, _handle_quote, sym.upper(), content)
+
+@tree.command(name="ask", description="Ask the trading assistant")
+@app_commands.describe(prompt="What you want the assistant to do")
+async def ask_command(interaction: discord.Interaction, prompt: str):
+    await _run_interaction(interaction, prompt, _handle_ask, prompt)
+
+@tree.command(name="confirm", description="Confirm your pending request in this channel")
+async def confirm_command(interaction: discord.Interaction):
+    await _run_interaction(interaction, "/confirm", _handle_pending, False)
+
+@tree.command(name="cancel", description="Cancel your pending request in this channel")
+async def cancel_command(interaction: discord.Interaction):
+    await _run_interaction(interaction, "/cancel", _handle_pending, True)
+
+# ---------- Plain messages (opt-in channels only) ----------
 @client.event
 async def on_message(message: discord.Message):
-    if message.author.bot:
+    if message.author.bot or str(message.channel.id) not in MESSAGE_CHANNEL_IDS:
         return
+    msg_sem, user_sem = _message_sems(message.author.id)
+    # user slot first so one user's backlog never holds global slots
+    async with user_sem, msg_sem:
+        await _handle_message(message)
+
+async def _handle_message(message: discord.Message):
     content = (message.content or "").strip()
     if not content:
         return
 
     ch_id = str(message.channel.id)
     u_id  = str(message.author.id)
+    send = message.channel.send
 
     # Discord IN
     try:
@@ -355,68 +753,41 @@ async def on_message(message: discord.Message):
         pass
 
     # Confirmation / Cancel handling (NEW)
-    lower = content.lower()
+    # only short messages can be a confirm/cancel word; don't lowercase long pastes
+    lower = content.lower() if len(content) <= _MAX_CONFIRM_LEN else ""
     if lower in CONFIRM_WORDS or lower in CANCEL_WORDS:
-        pending = _get_pending(ch_id)
-        if not pending:
-            await message.channel.send("I don't have anything pending confirmation.")
-            return
-        if pending["user_id"] != u_id:
-            await message.channel.send("Only the original requester can confirm or cancel this.")
-            return
+        return await _handle_pending(send, lower in CANCEL_WORDS, ch_id, u_id)
 
-        if lower in CANCEL_WORDS:
-            _clear_pending(ch_id, reason="canceled")
-            await message.channel.send("Okay, canceled.")
-            return
-
-        # Confirm path: resubmit original instruction to GPT prefixed with CONFIRM:
-        original = pending["original_text"]
-        _clear_pending(ch_id, reason="confirmed")
-        reply = await gpt_orchestrate(f"CONFIRM: {original}", ch_id, u_id)
-        await message.channel.send(reply)
-        try:
-            log_conversation(f"CONFIRM: {original}", reply, ch_id, u_id)
-            log_event("discord","out","assistant", ch_id, u_id, reply)
-        except Exception:
-            pass
-        return
-
-    # Simple command: quote SYMBOL
-    if lower.startswith("quote "):
-        sym = content.split(" ",1)[1].strip().upper()
-        try:
-            q = get_equity_quote(sym)
-            text = f"📈 {sym} quote:\n```json\n{json.dumps(q, indent=2)}```"
-            await message.channel.send(text)
-            log_conversation(content, text, ch_id, u_id)
-            log_event("discord","out","assistant", ch_id, u_id, {"quote_symbol": sym})
-            return
-        except Exception as e:
-            err = f"❌ Quote error: {e}"
-            await message.channel.send(err)
-            log_event("system","error","bot", ch_id, u_id, err)
-            return
+    # Simple commands, e.g. quote SYMBOL
+    m = content[:_COMMAND_HEAD_LEN].lower().startswith(_COMMAND_NAMES) and _COMMAND_RE.match(content)
+    if m:
+        return await _COMMANDS[m.group(1).lower()](send, m.group(2).upper(), content, ch_id, u_id)
 
     # Default: send to GPT
-    reply = await gpt_orchestrate(content, ch_id, u_id)
-    await message.channel.send(reply)
-    try:
-        log_conversation(content, reply, ch_id, u_id)
-        log_event("discord","out","assistant", ch_id, u_id, reply)
-    except Exception:
-        pass
-
-    # If GPT asked for confirmation, queue it (NEW)
-    # naive heuristic: look for the word "confirm" in GPT reply
-    if "confirm" in reply.lower():
-        _set_pending(ch_id, u_id, content)
+    await _handle_ask(send, content, ch_id, u_id)
 
 # ---------- Entrypoint ----------
+async def _run_client():
+    async with client:
+        try:
+            await client.start(DISCORD_TOKEN)
+        finally:
+            await _close_http()
+            if _openai is not None:
+                await _openai.close()
+
 def main():
     if not DISCORD_TOKEN:
         raise RuntimeError("DISCORD_TOKEN is not set")
-    client.run(DISCORD_TOKEN)
+    discord.utils.setup_logging()
+    try:
+        asyncio.run(_run_client())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # let an in-flight background flush finish before the final one
+        _sheets_executor.shutdown(wait=True)
+        _flush_pending()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file